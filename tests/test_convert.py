@@ -4,6 +4,7 @@ import logging
 
 import pytest
 
+from typeright.__main__ import CONFIG_FILES
 from typeright.__main__ import _main as main
 from typeright.fixes.fix_annotate_docs import FixAnnotateDocs
 
@@ -13,19 +14,23 @@ from typeright.fixes.fix_annotate_docs import FixAnnotateDocs
 #     return str(tree)
 
 
+@pytest.fixture(scope='session')
+def fixturedir(pytestconfig):
+    return pytestconfig.rootdir.join('tests', 'fixtures')
+
+
 @pytest.mark.parametrize("config", ['test1', 'test2'])
 @pytest.mark.parametrize("format", ['numpydoc', 'googledoc', 'restdoc', 'agnostic'])
-def test_cli(format, config, pytestconfig, tmpdir, caplog):
+def test_cli(format, config, fixturedir, tmpdir, caplog):
     FixAnnotateDocs.format_name = None
     FixAnnotateDocs.default_return_type = None
 
-    fixturedir = pytestconfig.rootdir.join('tests', 'fixtures')
-
     configdir = fixturedir.join('configs', config)
     results = fixturedir.join('results', '%s.%s.py' % (format, config))
     source = fixturedir.join('formats', (format + '.py'))
-    # change directory so we can control discovery of setup.cfg
-    configdir.chdir()
+    # pass the config files explicitly so we can control discovery of
+    # setup.cfg without changing the working directory
+    config_files = [str(configdir.join(name)) for name in CONFIG_FILES]
     dest = tmpdir.join((format + '.py'))
 
     # pytest calls basicConfig before main() gets a chance to.
@@ -38,7 +43,8 @@ def test_cli(format, config, pytestconfig, tmpdir, caplog):
                    "--py2-comment-style=single",
                    "--doc-format=auto",
                    "--quiet",
-                   "--output-dir", str(tmpdir), str(source)])
+                   "--output-dir", str(tmpdir), str(source)],
+                  config_files=config_files)
 
     assert errors == []
 
@@ -1,30 +1,56 @@
 from __future__ import print_function
 
 import argparse
-import json
 import logging
 import os
 import re
 import sys
-from lib2to3.main import StdoutRefactoringTool
 from os.path import expanduser, expandvars
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import six.moves.configparser as configparser
+from kids.cache import cache
 
-from typeright.annotations.main import generate_annotations_json_string
-from typeright.docs import formats
-from typeright.fixes.base import BaseFixAnnotateFromSignature, crawl_up
-from typeright.fixes.fix_annotate_any import FixAnnotateAny
-from typeright.fixes.fix_annotate_command import FixAnnotateCommand
-from typeright.fixes.fix_annotate_docs import FixAnnotateDocs
-from typeright.fixes.fix_annotate_json import FixAnnotateJson
+from typeright.docs import DOC_FORMAT_CHOICES
 
 NAME = 'typeright'
 CONFIG_FILES = [NAME + '.ini', 'setup.cfg']
-
-
+_SPLIT_RE = re.compile(r'[,\n]+')
+# argparse actions whose values can be read from a config file
+_STORE_ACTIONS = (
+    argparse._StoreFalseAction,
+    argparse._StoreTrueAction,
+    argparse._StoreAction,
+    argparse._StoreConstAction,
+)
+# same values as accepted by RawConfigParser.getboolean()
+_BOOLEAN_STATES = {'1': True, 'yes': True, 'true': True, 'on': True,
+                   '0': False, 'no': False, 'false': False, 'off': False}
+
+
+def _to_bool(value):
+    # type: (str) -> bool
+    try:
+        return _BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError('Not a boolean: %s' % value)
+
+
+_TYPE_CONVERTERS = {
+    int: int,
+    bool: _to_bool,
+    float: float,
+}
+
+
+@cache
 def get_parser():
+    # type: () -> argparse.ArgumentParser
+    """Return the command line parser.
+
+    The parser is built once and shared, so it must not be modified: apply
+    defaults to the namespace passed to parse_args() instead.
+    """
     parser = argparse.ArgumentParser()
 
     parser.add_argument('files', nargs='*', metavar="FILE",
@@ -54,7 +80,7 @@ def get_parser():
     doc_group = parser.add_argument_group('docstring options',
                                           "Generate type info by parsing docstrings")
     doc_group.add_argument("--doc-format",
-                           choices=sorted(list(formats.format_map.keys()) + ['auto', 'off']),
+                           choices=DOC_FORMAT_CHOICES,
                            help="Specify the docstring convention used within "
                                 "files to be converted ('auto' automatically "
                                 "determines the format by inspecting each docstring "
@@ -105,61 +131,106 @@ def get_parser():
     other_group.add_argument("-W", "--write-unchanged-files", action='store_true',
                              help="Also write files even if no changes were required"
                                   " (useful with --output-dir); implies -w.")
+    other_group.add_argument("--cache-dir", type=str, default=None,
+                             metavar="FOLDER",
+                             help="Cache parsed files in this directory, so that "
+                                  "files that are unchanged are not parsed again "
+                                  "on later runs.")
     return parser
 
 
-def load_config(arg_parser):
-    # type: (argparse.ArgumentParser) -> Dict
-    """Use the ArgumentParser to extract values set in a config file.
+@cache
+def _read_config(config_key):
+    # type: (Tuple[Tuple[str, float], ...]) -> Dict[str, str]
+    """Read the typeright section of the given config files.
+
+    `config_key` pairs each path with its modification time, so that a
+    config file is only parsed again if it has been edited since it was last
+    read.
 
-    These are used to set the defaults on the parser before calling
-    parse_args(), which ensures that arguments specified on the command line
-    have a higher priority than those set in the config file.
+    Returns
+    -------
+    Dict[str, str]
+        raw option values, keyed by lower-cased option name.  empty if no
+        file has a typeright section.
     """
-    SPLIT = re.compile('[,\n]+')
-    paths = [expanduser(expandvars(path)) for path in CONFIG_FILES]
     config_parser = configparser.RawConfigParser()
-    config_parser.read(paths)
-    defaults = {}
-    if config_parser.has_section(NAME):
-        for action in arg_parser._actions:
-            if action.dest in defaults:
-                # some arguments may refer to the same destination
-                continue
-            try:
-                if isinstance(action, argparse._HelpAction):
-                    continue
-                elif isinstance(action, (argparse._StoreFalseAction,
-                                         argparse._StoreTrueAction,
-                                         argparse._StoreAction,
-                                         argparse._StoreConstAction)):
-                    if action.type is int:
-                        val = config_parser.getint(NAME, action.dest)  # type: Any
-                    elif action.type is bool:
-                        val = config_parser.getboolean(NAME, action.dest)
-                    elif action.type is float:
-                        val = config_parser.getfloat(NAME, action.dest)
-                    else:
-                        val = config_parser.get(NAME, action.dest)
-                        if action.nargs in {'*', '+'}:
-                            val = [x for x in SPLIT.split(val) if x]
-                else:
-                    raise TypeError(action)
-            except configparser.NoOptionError:
-                continue
-            defaults[action.dest] = val
+    config_parser.read([path for path, _ in config_key])
+    if not config_parser.has_section(NAME):
+        return {}
+    return dict(config_parser.items(NAME))
+
+
+@cache
+def _get_actions(arg_parser):
+    # type: (argparse.ArgumentParser) -> Dict[str, argparse.Action]
+    """Return the parser's actions, keyed by destination."""
+    actions = {}  # type: Dict[str, argparse.Action]
+    for action in arg_parser._actions:
+        if not isinstance(action, argparse._HelpAction):
+            # some arguments may refer to the same destination
+            actions.setdefault(action.dest, action)
+    return actions
+
+
+def load_config(arg_parser, config_files=None):
+    # type: (argparse.ArgumentParser, Optional[List[str]]) -> Dict
+    """Use the ArgumentParser to extract values set in a config file.
+
+    These are used to populate the namespace passed to parse_args(), which
+    ensures that arguments specified on the command line have a higher
+    priority than those set in the config file.
+
+    `config_files` defaults to CONFIG_FILES, relative to the current
+    directory.
+    """
+    if config_files is None:
+        config_files = CONFIG_FILES
+    paths = [os.path.abspath(expanduser(expandvars(path))) for path in config_files]
+    config_key = tuple((path, os.path.getmtime(path))
+                       for path in paths if os.path.exists(path))
+    section = _read_config(config_key)
+    defaults = {}  # type: Dict[str, Any]
+    if not section:
+        return defaults
+
+    actions = _get_actions(arg_parser)
+    for option, raw in section.items():
+        action = actions.get(option)
+        if action is None:
+            continue
+        if not isinstance(action, _STORE_ACTIONS):
+            raise TypeError(action)
+        converter = _TYPE_CONVERTERS.get(action.type)
+        if converter is not None:
+            val = converter(raw)  # type: Any
+        else:
+            val = raw
+            if action.nargs in {'*', '+'}:
+                val = [x for x in _SPLIT_RE.split(val) if x]
+        defaults[action.dest] = val
 
     return defaults
 
 
-def _main(args_override=None):
-    # type: (Optional[List[str]]) -> List[str]
+def _main(args_override=None, config_files=None):
+    # type: (Optional[List[str]], Optional[List[str]]) -> List[str]
 
     parser = get_parser()
-    defaults = load_config(parser)
-    parser.set_defaults(**defaults)
-    # Parse command line.
-    args = parser.parse_args(args_override)
+    defaults = load_config(parser, config_files)
+    # Parse command line.  The parser is shared, so rather than changing its
+    # defaults, pass the config values in on the namespace, where they take
+    # precedence over the parser's defaults but not over the command line.
+    args = parser.parse_args(args_override, argparse.Namespace(**defaults))
+    if not args.files:
+        # argparse always stores a positional with nargs='*', even when it is
+        # not given, which replaces the value from the config file.
+        args.files = defaults.get('files', [])
+
+    # lib2to3 loads its grammar when imported, so defer this until we know
+    # that there is work to do.
+    from typeright.fixes.base import BaseFixAnnotateFromSignature, crawl_up
+    from typeright.refactor import ModifiedRefactoringTool
 
     annotation_style = args.annotation_style
     if annotation_style == 'auto':
@@ -192,37 +263,49 @@ def _main(args_override=None):
     }
 
     if args.type_info:
+        from typeright.fixes.fix_annotate_json import FixAnnotateJson
+
+        # Run pass 2 with output into a variable.
         # Produce nice error message if type_info.json not found.
         try:
-            with open(args.type_info) as f:
-                contents = f.read()
+            if args.uses_signature:
+                try:
+                    import orjson as json
+                except ImportError:
+                    import json  # type: ignore
+                with open(args.type_info, 'rb') as type_info_file:
+                    data = json.loads(type_info_file.read())  # type: List[Any]
+            else:
+                from typeright.annotations.main import generate_annotations_json_string
+                # the file is read by parse_json()
+                data = generate_annotations_json_string(
+                    args.type_info,
+                    only_simple=args.only_simple)
         except IOError as err:
             sys.exit("Can't open type info file: %s" % err)
 
-        # Run pass 2 with output into a variable.
-        if args.uses_signature:
-            data = json.loads(contents)  # type: List[Any]
-        else:
-            data = generate_annotations_json_string(
-                args.type_info,
-                only_simple=args.only_simple)
-
-        # FIXME: in multi-process mode it may be faster to pass the json
-        #  file name and re-read it, rather than copy the data into each process
         options['type_info'] = data
         options['top_dir'] = input_base_dir
         add_fixer(FixAnnotateJson)
 
     if args.command:
+        from typeright.fixes.fix_annotate_command import (FixAnnotateCommand,
+                                                          check_command)
+        try:
+            check_command(args.command)
+        except ValueError as err:
+            sys.exit(str(err))
         options['command'] = args.command
         add_fixer(FixAnnotateCommand)
 
     if args.doc_format not in {None, 'off'}:
+        from typeright.fixes.fix_annotate_docs import FixAnnotateDocs
         options['doc_format'] = args.doc_format
         options['doc_default_return_type'] = args.doc_default_return_type
         add_fixer(FixAnnotateDocs)
 
     if args.auto_any:
+        from typeright.fixes.fix_annotate_any import FixAnnotateAny
         add_fixer(FixAnnotateAny)
 
     flags = {
@@ -230,7 +313,7 @@ def _main(args_override=None):
         'print_function': args.print_function,
         'typeright': options,
     }
-    rt = StdoutRefactoringTool(
+    rt = ModifiedRefactoringTool(
         fixers=fixers,
         options=flags,
         explicit=fixers,
@@ -238,6 +321,7 @@ def _main(args_override=None):
         show_diffs=not args.quiet,
         input_base_dir=input_base_dir,
         output_dir=args.output_dir,
+        cache_dir=args.cache_dir and expanduser(args.cache_dir),
     )
     if not rt.errors:
         with BaseFixAnnotateFromSignature.max_line_drift_set(args.max_line_drift):
@@ -5,11 +5,15 @@ Parse JSON data and also parse type comment strings into type objects.
 The collect_types tool is in pyannotate_runtime/collect_types.py.
 """
 
-import json
 import re
 import sys
 from typing import Any, List, Mapping, NoReturn, Set, Text, Tuple
 
+try:
+    import orjson as json
+except ImportError:
+    import json  # type: ignore
+
 if sys.version_info[:2] < (3, 10):
     from typing_extensions import TypedDict
 else:
@@ -89,8 +93,8 @@ def parse_json(path):
 
     The input JSON is expected to to have a list of RawEntry items.
     """
-    with open(path) as f:
-        data = json.load(f)  # type: List[RawEntry]
+    with open(path, 'rb') as f:
+        data = json.loads(f.read())  # type: List[RawEntry]
     result = []
 
     def assert_type(value, typ):
@@ -1,5 +1,6 @@
 """Some (nearly) end-to-end testing."""
 
+import argparse
 import json
 import os
 import re
@@ -19,6 +20,8 @@ else:
 
 from typing import List
 
+from typeright.__main__ import get_parser, load_config
+from typeright.__main__ import _main
 from typeright.__main__ import main as dunder_main
 
 
@@ -45,6 +48,113 @@ class TestDunderMain(unittest.TestCase):
         # type: () -> None
         self.main_test(["--help"], r"^usage:", r"^$", 0)
 
+    def test_format_names(self):
+        # type: () -> None
+        from typeright.docs import format_names, formats
+        assert sorted(format_names) == sorted(formats.format_map)
+
+    def test_directory(self):
+        # type: () -> None
+        source_text = "def f(a):\n    return a\n"
+        annotated_text = "def f(a):\n    # type: (Any) -> Any\n    return a\n"
+        for name in ['pkg/a.py', 'pkg/sub/b.py', 'pkg/.hidden/c.py', 'pkg/d.txt']:
+            if not os.path.isdir(os.path.dirname(name)):
+                os.makedirs(os.path.dirname(name))
+            self.write_file(name, source_text)
+        dunder_main(['pkg', '-a', '-w', '-q', '--annotation-style=py2'])
+        for name, expected in [('pkg/a.py', annotated_text),
+                               ('pkg/sub/b.py', annotated_text),
+                               ('pkg/.hidden/c.py', source_text),
+                               ('pkg/d.txt', source_text)]:
+            with open(name) as f:
+                assert f.read().endswith(expected), name
+
+    def test_processes(self):
+        # type: () -> None
+        import multiprocessing
+        source_text = "def f(a):\n    return a\n"
+        annotated_text = "def f(a):\n    # type: (Any) -> Any\n    return a\n"
+        names = ['pkg/a.py', 'pkg/b.py', 'pkg/c.py']
+        os.makedirs('pkg')
+        for name in names:
+            self.write_file(name, source_text)
+        get_start_method = getattr(multiprocessing, 'get_start_method', None)
+        start_method = get_start_method and get_start_method(allow_none=True)
+        dunder_main(['pkg', '-a', '-w', '-q', '-j', '2', '--annotation-style=py2'])
+        for name in names:
+            with open(name) as f:
+                assert f.read().endswith(annotated_text), name
+        # the start method of the process is left alone
+        if get_start_method:
+            assert get_start_method(allow_none=True) == start_method
+
+    def test_directory_error(self):
+        # type: () -> None
+        os.makedirs('pkg')
+        self.write_file('pkg/a.py', "def f(a):\n    return a\n")
+        self.write_file('pkg/b.py', "def f(:\n")
+        # without -j, files are refactored in this process, so the error is
+        # reported in the exit status
+        assert dunder_main(['pkg', '-a', '-q', '--annotation-style=py2']) == 1
+
+    def test_cache_dir(self):
+        # type: () -> None
+        source_text = "def f(a):\n    return a\n"
+        annotated_text = "def f(a):\n    # type: (Any) -> Any\n    return a\n"
+        args = ['a.py', '-a', '-w', '-q', '--annotation-style=py2',
+                '--cache-dir', 'cache']
+        self.write_file('a.py', source_text)
+        dunder_main(args)
+        assert len(os.listdir('cache')) == 1
+        # the second run reads the tree from the cache, before it was modified
+        self.write_file('a.py', source_text)
+        dunder_main(args)
+        assert len(os.listdir('cache')) == 1
+        with open('a.py') as f:
+            assert f.read().endswith(annotated_text)
+
+    def test_cache_dir_old_options(self):
+        # type: () -> None
+        # lib2to3 before python 3.8 has no exec_function option
+        from typeright.refactor import ModifiedRefactoringTool
+        rt = ModifiedRefactoringTool([], {}, [], nobackups=True,
+                                     show_diffs=False, cache_dir='cache')
+        rt.options.pop('exec_function', None)
+        for _ in range(2):
+            tree = rt.refactor_string("def f(a):\n    return a\n", 'a.py')
+            assert str(tree) == "def f(a):\n    return a\n"
+        assert len(os.listdir('cache')) == 1
+
+    def test_load_config(self):
+        # type: () -> None
+        self.write_file('typeright.ini', '[typeright]\nmax_line_drift = 3\n')
+        assert load_config(get_parser()) == {'max_line_drift': 3}
+        # edits to the config file are picked up
+        self.write_file('typeright.ini', '[typeright]\nmax_line_drift = 7\n')
+        stat = os.stat('typeright.ini')
+        os.utime('typeright.ini', (stat.st_atime, stat.st_mtime + 10))
+        assert load_config(get_parser()) == {'max_line_drift': 7}
+
+    def test_load_config_action_subclass(self):
+        # type: () -> None
+        class CustomStoreAction(argparse._StoreAction):
+            pass
+
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--custom', action=CustomStoreAction)
+        self.write_file('typeright.ini', '[typeright]\ncustom = value\n')
+        assert load_config(parser) == {'custom': 'value'}
+
+    def test_config_files(self):
+        # type: () -> None
+        self.write_file('a.py', "def f(a):\n    return a\n")
+        self.write_file('typeright.ini',
+                        '[typeright]\nfiles = a.py\nauto_any = true\n'
+                        'write = true\nquiet = true\nannotation_style = py2\n')
+        assert _main([], config_files=['typeright.ini']) == []
+        with open('a.py') as f:
+            assert f.read().endswith("# type: (Any) -> Any\n    return a\n")
+
     def test_preview(self):
         # type: () -> None
         self.prototype_test(write=False)
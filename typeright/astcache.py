@@ -0,0 +1,81 @@
+"""
+An on-disk cache of parsed lib2to3 trees, keyed on the source they were
+parsed from
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from typing import Optional
+
+from lib2to3.pytree import Node
+
+# Bump this whenever a change to typeright affects the trees it parses.
+CACHE_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def get_key(data, grammar_name):
+    # type: (str, str) -> str
+    """Return the cache key for `data` parsed with the named grammar.
+
+    The key includes the version of python, as lib2to3 (and so its trees)
+    differ between python versions.
+    """
+    tag = '%s:%d.%d.%d:%s' % (CACHE_VERSION, sys.version_info[0],
+                              sys.version_info[1], sys.version_info[2],
+                              grammar_name)
+    digest = hashlib.sha256(tag.encode('utf-8'))
+    digest.update(data.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load(cache_dir, key):
+    # type: (str, str) -> Optional[Node]
+    """Return the tree stored under `key`, or None if there is none."""
+    path = os.path.join(cache_dir, key + '.pkl')
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (IOError, OSError):
+        return None
+    except Exception as err:
+        # a corrupt or incompatible entry: behave as if it were missing
+        logger.debug("Can't read cached tree %s: %s", path, err)
+        return None
+
+
+def store(cache_dir, key, tree):
+    # type: (str, str, Node) -> None
+    """Store `tree` under `key`.
+
+    The file is written atomically, so that parallel processes never see a
+    partially written entry.
+    """
+    try:
+        data = pickle.dumps(tree, protocol=2)
+    except RuntimeError as err:
+        # very deeply nested trees can exceed the recursion limit
+        logger.debug("Can't cache tree: %s", err)
+        return
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # os.replace() overwrites an existing entry on windows, too
+            replace = getattr(os, 'replace', os.rename)
+            replace(tmp_path, os.path.join(cache_dir, key + '.pkl'))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+    except (IOError, OSError) as err:
+        logger.debug("Can't write cached tree: %s", err)
@@ -0,0 +1,6 @@
+# names of the docstring formats in typeright.docs.formats.format_map, kept
+# here so that they can be listed without importing the formats themselves
+format_names = ('google', 'numpy', 'rest')
+
+# choices for the --doc-format command line option
+DOC_FORMAT_CHOICES = tuple(sorted(format_names + ('auto', 'off')))
@@ -41,11 +41,13 @@ from lib2to3.fixer_util import (does_tree_import, find_indentation, syms,
 from lib2to3.patcomp import compile_pattern
 from lib2to3.pgen2 import token
 from lib2to3.pytree import Base, Leaf, Node
-from typing import (Any, Dict, Iterator, List, Match, Optional, Set, Text,
+from typing import (Any, Dict, List, Match, Optional, Sequence, Set, Text,
                     Tuple, Union)
-from typing import __all__ as typing_all  # type: ignore
+from typing import __all__ as _typing_all  # type: ignore
 
-from typeright.fixes.fixer_utils import (create_import,
+from six.moves import intern
+
+from typeright.fixes.fixer_utils import (clear_import_index, create_import,
                                           create_type_checking_import,
                                           get_unprotected_imports,
                                           type_by_import_stmt)
@@ -54,7 +56,13 @@ from typeright.fixes.fixer_utils import (create_import,
 # https://github.com/python/mypy/blob/745d300b8304c3dcf601477762bf9d70b9a4619c/mypy/main.py#L503
 
 PY_EXTENSIONS = ['.pyi', '.py']
-TYPE_REG = re.compile('\s*#\s*type:.*')
+TYPE_REG = re.compile(r'\s*#\s*type:')
+TYPE_NAME_REG = re.compile(r'[\w.:]+')
+# typing.__all__ is a list: use a set for fast membership tests
+typing_all = frozenset(_typing_all)
+# builtin types, which need neither renaming nor an import
+BUILTIN_TYPE_NAMES = frozenset(['None', 'bool', 'bytes', 'complex', 'float',
+                                'int', 'object', 'str', 'unicode'])
 
 
 def crawl_up(arg):
@@ -87,6 +95,14 @@ def strip_py(arg):
     return None
 
 
+def intern_str(arg):
+    # type: (Text) -> Text
+    """Intern a native string, so that it compares equal by identity.
+    Other strings (i.e. unicode on python 2) are returned unchanged.
+    """
+    return intern(arg) if isinstance(arg, str) else arg
+
+
 def get_init_file(dir):
     # type: (str) -> Optional[str]
     """Check whether a directory contains a file named __init__.py[i].
@@ -101,8 +117,8 @@ def get_init_file(dir):
     return None
 
 
-def get_funcname(node):
-    # type: (Optional[Union[Leaf, Node]]) -> Text
+def get_funcname(node, scope_names=None):
+    # type: (Optional[Union[Leaf, Node]], Optional[Dict[int, Tuple[Base, Text]]]) -> Text
     """Get function name by (approximately) the following rules:
 
     - function -> function_name
@@ -111,16 +127,33 @@ def get_funcname(node):
     More specifically, we include every class and function name that
     the node is a child of, so nested classes and functions get names like
     OuterClass.InnerClass.outer_fn.inner_fn.
+
+    If `scope_names` is given, it maps id(scope) -> (scope, name) for the
+    classes and functions whose name is already known: the walk up the tree
+    stops at the first of them, and the scopes found on the way are added
+    to it, so that sibling functions share the name of their parents.
     """
-    components = []  # type: List[str]
+    scopes = []  # type: List[Base]
+    prefix = ''
     while node:
         if node.type in (syms.classdef, syms.funcdef):
-            name = node.children[1]
-            assert name.type == token.NAME, repr(name)
-            assert isinstance(name, Leaf)  # Same as previous, for mypy
-            components.append(name.value)
+            if scope_names is not None:
+                entry = scope_names.get(id(node))
+                if entry is not None:
+                    prefix = entry[1]
+                    break
+            scopes.append(node)
         node = node.parent
-    return '.'.join(reversed(components))
+    for scope in reversed(scopes):
+        name = scope.children[1]
+        assert name.type == token.NAME, repr(name)
+        assert isinstance(name, Leaf)  # Same as previous, for mypy
+        prefix = prefix + '.' + name.value if prefix else name.value
+        if scope_names is not None:
+            # the entry holds a reference to the scope, which keeps it alive
+            # and so its id from being reused by another node
+            scope_names[id(scope)] = (scope, prefix)
+    return prefix
 
 
 def count_args(node, results):
@@ -151,27 +184,84 @@ def count_args(node, results):
     for child in children:
         if skip:
             skip = False
-        elif isinstance(child, Leaf):
+        elif type(child) is Leaf:
+            child_type = child.type
             # A single '*' indicates the rest of the arguments are keyword only
             # and shouldn't be counted as a `*`.
-            if child.type == token.STAR:
+            if child_type == token.STAR:
                 previous_token_is_star = True
-            elif child.type == token.DOUBLESTAR:
+                continue
+            elif child_type == token.DOUBLESTAR:
                 starstar = True
-            elif child.type == token.NAME:
+            elif child_type == token.NAME:
                 if count == 0:
                     if child.value in ('self', 'cls'):
                         selfish = True
                 count += 1
                 if previous_token_is_star:
                     star = True
-            elif child.type == token.EQUAL:
+            elif child_type == token.EQUAL:
                 skip = True
-            if child.type != token.STAR:
-                previous_token_is_star = False
+            previous_token_is_star = False
     return count, selfish, star, starstar
 
 
+def _find_matches(node, patterns):
+    # type: (Base, Sequence[Any]) -> List[bool]
+    """Return whether each of `patterns` matches `node` or any node below it,
+    without descending into nested functions and classes.
+
+    The tree is traversed once for all of the patterns, and only until each
+    of them has matched.
+    """
+    matchers = [pattern.match for pattern in patterns]
+    found = [False] * len(matchers)
+    remaining = len(matchers)
+    nodes = [node]
+    while nodes and remaining:
+        node = nodes.pop()
+        for i, match in enumerate(matchers):
+            # no results dict is passed, as the matched nodes are not needed
+            if not found[i] and match(node):
+                found[i] = True
+                remaining -= 1
+        nodes.extend(child for child in node.children
+                     if child.type not in (syms.funcdef, syms.classdef))
+    return found
+
+
+def _contains_match(node, pattern):
+    # type: (Base, Any) -> bool
+    """Return whether `pattern` matches `node` or any node below it, without
+    descending into nested functions and classes.
+    """
+    return _find_matches(node, [pattern])[0]
+
+
+def _is_type_comment_prefix(prefix):
+    # type: (Text) -> bool
+    # the substring test is a cheap filter for the common case
+    return '# type:' in prefix and prefix.lstrip().startswith('# type:')
+
+
+def _has_type_comment(node):
+    # type: (Base) -> bool
+    """Return whether the prefix of `node`, or of any node below it, starts
+    with a type comment.
+    """
+    # an explicit stack is cheaper than the nested generators of pre_order()
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        if node.children:
+            # the prefix of a node is that of its first leaf, so only the
+            # leaves need to be checked
+            nodes.extend(node.children)
+        elif _is_type_comment_prefix(node.prefix):
+            return True
+    return False
+
+
 def is_type_comment(comment):
     return TYPE_REG.match(comment)
 
@@ -199,26 +289,39 @@ class BaseFixAnnotate(BaseFix):
             self._type_options = self.options.get('typeright', {})
         return self._type_options
 
+    def start_tree(self, tree, filename):
+        super(BaseFixAnnotate, self).start_tree(tree, filename)
+        # looked up once per tree, rather than once per function
+        self._annotation_style = self.type_options.get('annotation_style')
+        self._comment_style = self.type_options.get('comment_style')
+        # maps id(scope) -> (scope, name) for the classes and functions
+        # named by get_funcname()
+        self._scope_names = {}  # type: Dict[int, Tuple[Base, Text]]
+
+    def get_funcname(self, node):
+        # type: (Base) -> Text
+        """Version of the get_funcname() function that remembers the names
+        of the enclosing classes and functions of the current tree.
+        """
+        return get_funcname(node, self._scope_names)
+
     def should_skip(self, node, results):
         if BaseFixAnnotate.counter is not None:
             if BaseFixAnnotate.counter <= 0:
                 return True
 
-        # Check if there's already a long-form annotation for some argument.
-        parameters = results.get('parameters')
-        if parameters is not None:
-            for ch in parameters.pre_order():
-                if ch.prefix.lstrip().startswith('# type:'):
-                    return True
-
-        args = results.get('args')
-        if args is not None:
-            for ch in args.pre_order():
-                if ch.prefix.lstrip().startswith('# type:'):
-                    return True
-
         children = results['suite'][0].children
 
+        # Check if there's already a long-form annotation for some argument
+        # (args is part of the parameters node, so this covers it, too), or
+        # an annotation at the start of the suite (see below).
+        parameters = results.get('parameters')
+        if parameters is not None and _has_type_comment(parameters):
+            return True
+        for ch in children:
+            if _is_type_comment_prefix(ch.prefix):
+                return True
+
         # NOTE: I've reverse-engineered the structure of the parse tree.
         # It's always a list of nodes, the first of which contains the
         # entire suite.  Its children seem to be:
@@ -233,11 +336,6 @@ class BaseFixAnnotate(BaseFix):
         # "Compact" functions (e.g. "def foo(x, y): return max(x, y)")
         # have a different structure (no NEWLINE, INDENT, or DEDENT).
 
-        # Check if there's already an annotation.
-        for ch in children:
-            if ch.prefix.lstrip().startswith('# type:'):
-                return True  # There's already a # type: comment here; don't change anything.
-
         # Python 3 style return annotation are already skipped by the pattern
 
         # Python 3 style argument annotation structure
@@ -284,6 +382,7 @@ class BaseFixAnnotate(BaseFix):
         # + RPAR ')'
 
         # Let's skip Python 3 argument annotations
+        args = results.get('args')
         it = iter(args.children) if args else iter([])
         for ch in it:
             if ch.type == token.STAR:
@@ -323,7 +422,7 @@ class BaseFixAnnotate(BaseFix):
             return
         argtypes, restype = annot
 
-        if self.type_options['annotation_style'] == 'py3':
+        if self._annotation_style == 'py3':
             self.add_py3_annot(argtypes, restype, node, results)
         else:
             self.add_py2_annot(argtypes, restype, node, results)
@@ -343,38 +442,45 @@ class BaseFixAnnotate(BaseFix):
         argleaves = []  # type: List[Tuple[str, Leaf]]
         if args is None:
             # function with 0 arguments
-            it = iter([])  # type: Iterator[Union[Leaf, Node]]
+            children = []  # type: List[Union[Leaf, Node]]
         elif len(args.children) == 0:
             # function with 1 argument
-            it = iter([args])
+            children = [args]
         else:
             # function with multiple arguments or 1 arg with default value
-            it = iter(args.children)
+            children = args.children
 
-        for ch in it:
+        # step through the children by index: running off the end is the
+        # normal way out of this loop, and checking the index is cheaper than
+        # catching StopIteration from next()
+        i = 0
+        num_children = len(children)
+        while i < num_children:
+            ch = children[i]
+            i += 1
             argstyle = 'name'
             if ch.type == token.STAR:
                 # *arg part
                 argstyle = 'star'
-                ch = next(it)
+                ch = children[i]
+                i += 1
                 if ch.type == token.COMMA:
                     continue
             elif ch.type == token.DOUBLESTAR:
                 # *arg part
                 argstyle = 'keyword'
-                ch = next(it)
+                ch = children[i]
+                i += 1
             assert ch.type == token.NAME
             assert isinstance(ch, Leaf)
             argleaves.append((argstyle, ch))
-            try:
-                ch = next(it)
-                if ch.type == token.EQUAL:
-                    ch = next(it)
-                    ch = next(it)
-                assert ch.type == token.COMMA
-                continue
-            except StopIteration:
+            if i < num_children and children[i].type == token.EQUAL:
+                # skip the '=' and the default value
+                i += 2
+            if i >= num_children:
                 break
+            assert children[i].type == token.COMMA
+            i += 1
 
         # when self or cls is not annotated, argleaves == argtypes+1
         argleaves = argleaves[len(argleaves) - len(argtypes):]
@@ -409,9 +515,10 @@ class BaseFixAnnotate(BaseFix):
 
     def use_py2_long_form(self, argtypes, short_str, degen_str):
         # type: (List[str], str, str) -> bool
-        if self.type_options['comment_style'] == 'single':
+        comment_style = self._comment_style
+        if comment_style == 'single':
             return False
-        elif self.type_options['comment_style'] == 'multi':
+        elif comment_style == 'multi':
             return False
         else:  # auto
             return ((len(short_str) > 64 or len(argtypes) > 5)
@@ -420,7 +527,8 @@ class BaseFixAnnotate(BaseFix):
     def add_py2_annot(self, argtypes, restype, node, results):
         # type: (List[str], str, Node, Dict[str, Any]) -> None
 
-        children = results['suite'][0].children
+        suite = results['suite'][0]
+        children = suite.children
 
         # Insert '# type: {annot}' comment.
         # For reference, see lib2to3/fixes/fix_tuple_params.py in stdlib.
@@ -428,10 +536,15 @@ class BaseFixAnnotate(BaseFix):
             # one liner function
             if children[0].prefix.strip() == '':
                 children[0].prefix = ''
-                children.insert(0, Leaf(token.NEWLINE, '\n'))
-                children.insert(
-                    1, Leaf(token.INDENT, find_indentation(node) + '    '))
-                children.append(Leaf(token.DEDENT, ''))
+                newline = Leaf(token.NEWLINE, '\n')
+                indent = Leaf(token.INDENT, find_indentation(node) + '    ')
+                dedent = Leaf(token.DEDENT, '')
+                newline.parent = indent.parent = dedent.parent = suite
+                # splice the leaves in at once, rather than shifting the
+                # children once per inserted leaf
+                children[0:0] = [newline, indent]
+                children.append(dedent)
+                suite.changed()
 
         if len(children) >= 2 and children[1].type == token.INDENT:
             degen_str = '(...) -> %s' % restype
@@ -524,6 +637,7 @@ class BaseFixAnnotate(BaseFix):
         for typ in types:
             if 'Any' in typ:
                 touch_import('typing', 'Any', node)
+                clear_import_index(node)
                 break
 
     def make_annotation(self, node, results):
@@ -582,28 +696,21 @@ class BaseFixAnnotate(BaseFix):
         Return True if at least 'return expr' is found, False if not.
         (If both 'return' and 'return expr' are found, return True.)
         """
-        results = {}
-        if self.return_expr.match(node, results):
-            return True
-        for child in node.children:
-            if child.type not in (syms.funcdef, syms.classdef):
-                if self.has_return_exprs(child):
-                    return True
-        return False
+        return _contains_match(node, self.return_expr)
 
     YIELD_EXPR = "yield_expr< 'yield' [any] >"
     yield_expr = compile_pattern(YIELD_EXPR)
 
-    def is_generator(self, node):
-        """Traverse the tree below node looking for 'yield [expr]'."""
-        results = {}
-        if self.yield_expr.match(node, results):
-            return True
-        for child in node.children:
-            if child.type not in (syms.funcdef, syms.classdef):
-                if self.is_generator(child):
-                    return True
-        return False
+    def analyze_body(self, node):
+        # type: (Node) -> Tuple[bool, bool]
+        """Traverse the tree below node once, looking for both 'return expr'
+        and 'yield [expr]'.
+
+        Return a tuple of whether each was found.
+        """
+        has_return_expr, is_generator = _find_matches(
+            node, [self.return_expr, self.yield_expr])
+        return has_return_expr, is_generator
 
 
 class BaseFixAnnotateFromSignature(BaseFixAnnotate):
@@ -656,22 +763,61 @@ class BaseFixAnnotateFromSignature(BaseFixAnnotate):
         node : Node
         """
         if word in typing_all:
-            if not type_by_import_stmt('typing', word, node):
+            if not self.type_by_import_stmt('typing', word, node):
                 # No import statement was found, should import
                 self.add_import('typing', word)
 
     def patch_imports(self, types, node):
-        if self.needed_imports:
+        if self.needed_imports or self.needed_type_checking_imports:
             for mod, name in sorted(self.needed_imports):
                 create_import(mod, name, node)
-        if self.needed_type_checking_imports:
             for mod, name in sorted(self.needed_type_checking_imports):
                 create_type_checking_import(mod, name, node)
+            # the imports of the tree have changed
+            clear_import_index(node)
+            self.clear_import_caches()
         self.needed_imports.clear()
         self.needed_type_checking_imports.clear()
 
+    def start_tree(self, tree, filename):
+        super(BaseFixAnnotateFromSignature, self).start_tree(tree, filename)
+        self.clear_import_caches()
+
+    def clear_import_caches(self):
+        # type: () -> None
+        """Forget what is known about the imports of the current tree."""
+        self._import_stmt_cache = {}  # type: Dict[Tuple[str, str], Optional[str]]
+        self._unprotected_imports = None  # type: Optional[Set[str]]
+
+    def type_by_import_stmt(self, package, name, node):
+        # type: (str, str, Node) -> Optional[str]
+        """Memoized version of fixer_utils.type_by_import_stmt().
+
+        Valid until the imports of the current tree are changed by
+        patch_imports().
+        """
+        key = (package, name)
+        try:
+            return self._import_stmt_cache[key]
+        except KeyError:
+            result = type_by_import_stmt(package, name, node)
+            self._import_stmt_cache[key] = result
+            return result
+
+    def get_unprotected_imports(self, node):
+        # type: (Node) -> Set[str]
+        """Memoized version of fixer_utils.get_unprotected_imports().
+
+        Valid until the imports of the current tree are changed by
+        patch_imports().
+        """
+        if self._unprotected_imports is None:
+            self._unprotected_imports = get_unprotected_imports(node)
+        return self._unprotected_imports
+
     def set_filename(self, filename):
         super(BaseFixAnnotateFromSignature, self).set_filename(filename)
+        self._abs_filename = intern_str(os.path.abspath(filename))
         self._current_module = crawl_up(filename)[1]
 
     def current_module(self):
@@ -689,7 +835,7 @@ class BaseFixAnnotateFromSignature(BaseFixAnnotate):
         name = results['name']
         assert isinstance(name, Leaf), repr(name)
         assert name.type == token.NAME, repr(name)
-        funcname = get_funcname(node)
+        funcname = self.get_funcname(node)
 
         def make(node, results, funcname):
             # type: (Node, Any, str) -> Optional[Tuple[List[str], str]]
@@ -742,11 +888,12 @@ class BaseFixAnnotateFromSignature(BaseFixAnnotate):
             return None
 
         arg_types = [self.update_type_names(arg_type, node) for arg_type in arg_types]
+        has_return_expr, is_generator = self.analyze_body(node)
         # Avoid common error "No return value expected"
-        if ret_type == 'None' and self.has_return_exprs(node):
+        if ret_type == 'None' and has_return_expr:
             ret_type = 'Optional[Any]'
         # Special case for generators.
-        if (self.is_generator(node) and
+        if (is_generator and
                 not (ret_type == 'Iterator' or ret_type.startswith('Iterator['))):
             if ret_type.startswith('Optional['):
                 assert ret_type[-1] == ']'
@@ -758,9 +905,19 @@ class BaseFixAnnotateFromSignature(BaseFixAnnotate):
     def update_type_names(self, type_str, node):
         # type: (str, Node) -> str
         """Fixup module names and add necessary imports."""
+        if type_str in BUILTIN_TYPE_NAMES:
+            return type_str
+        if '.' not in type_str and ':' not in type_str:
+            # Nothing to replace (this is the common case): type_updater()
+            # returns undotted words unchanged, so there is no need to
+            # rebuild the string, but it must still see each word to record
+            # the imports it needs.
+            for match in TYPE_NAME_REG.finditer(type_str):
+                self.type_updater(match, node)
+            return type_str
         # Replace e.g. `List[pkg.mod.SomeClass]` with
         # `List[SomeClass]` and remember to import it.
-        return re.sub(r'[\w.:]+', lambda m: self.type_updater(m, node), type_str)
+        return TYPE_NAME_REG.sub(lambda m: self.type_updater(m, node), type_str)
 
     def type_updater(self, match, node):
         # type: (Match, Node) -> str
@@ -785,7 +942,7 @@ class BaseFixAnnotateFromSignature(BaseFixAnnotate):
             to_import = name
 
         # Get the typename we need to use to be valid for a current import statement
-        result = type_by_import_stmt(mod, to_import, node)
+        result = self.type_by_import_stmt(mod, to_import, node)
 
         if result is not None:
             # There exists a current import statement this type is valid for
@@ -794,7 +951,7 @@ class BaseFixAnnotateFromSignature(BaseFixAnnotate):
 
         in_type_checking = True
         # Get a list of cached imports from this node's root
-        unprotected_imports = get_unprotected_imports(node)
+        unprotected_imports = self.get_unprotected_imports(node)
         if mod in unprotected_imports:
             # If this mod was already imported in the original file, its safe to import from again
             in_type_checking = False
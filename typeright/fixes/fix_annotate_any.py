@@ -6,6 +6,8 @@ from lib2to3.pytree import Leaf, Node
 
 from .base import BaseFixAnnotate
 
+INT_LITERAL_REG = re.compile(r'\d+[lL]?$')
+
 
 class FixAnnotateAny(BaseFixAnnotate):
     """Fixer that inserts Any for all types"""
@@ -35,9 +37,11 @@ class FixAnnotateAny(BaseFixAnnotate):
         at_start = True
         for child in children:
             if isinstance(child, Leaf):
-                if child.value in ('*', '**'):
+                # dispatch on the token type, rather than comparing values
+                child_type = child.type
+                if child_type in (token.STAR, token.DOUBLESTAR):
                     stars += child.value
-                elif child.type == token.NAME and not in_default:
+                elif child_type == token.NAME and not in_default:
                     if not is_method or not at_start or 'staticmethod' in decorators:
                         inferred_type = 'Any'
                     else:
@@ -47,22 +51,22 @@ class FixAnnotateAny(BaseFixAnnotate):
                             pass
                         else:
                             inferred_type = 'Any'
-                elif child.value == '=':
+                elif child_type == token.EQUAL:
                     in_default = True
-                elif in_default and child.value != ',':
-                    if child.type == token.NUMBER:
-                        if re.match(r'\d+[lL]?$', child.value):
+                elif in_default and child_type != token.COMMA:
+                    if child_type == token.NUMBER:
+                        if INT_LITERAL_REG.match(child.value):
                             inferred_type = 'int'
                         else:
                             inferred_type = 'float'  # TODO: complex?
-                    elif child.type == token.STRING:
+                    elif child_type == token.STRING:
                         if child.value.startswith(('u', 'U')):
                             inferred_type = 'unicode'
                         else:
                             inferred_type = 'str'
-                    elif child.type == token.NAME and child.value in ('True', 'False'):
+                    elif child_type == token.NAME and child.value in ('True', 'False'):
                         inferred_type = 'bool'
-                elif child.value == ',':
+                elif child_type == token.COMMA:
                     if inferred_type:
                         argtypes.append(stars + inferred_type)
                     # Reset
@@ -1,15 +1,27 @@
 from __future__ import absolute_import, print_function
 
-import json
 import re
 import shlex
+import string
 import subprocess
+from lib2to3.fixer_util import syms
 from lib2to3.pytree import Node
 from typing import Any, Dict, List, Optional, Tuple
 
+from kids.cache import cache
+
+try:
+    import orjson as json
+except ImportError:
+    import json  # type: ignore
+
 from .fix_annotate_json import BaseFixAnnotateFromSignature
 
 REG = re.compile(r'`-?\d+')
+# the placeholders available to a command run for each function, and to a
+# command run once per file
+COMMAND_FIELDS = frozenset(['filename', 'lineno', 'funcname'])
+BATCH_COMMAND_FIELDS = frozenset(['filename', 'linenos'])
 
 
 def cleanup(s, node):
@@ -22,37 +34,150 @@ def cleanup(s, node):
         return REG.sub('', s)
 
 
+@cache
+def split_command(command):
+    # type: (str) -> Tuple[str, ...]
+    """Split a command template into its arguments.
+
+    The placeholders within each argument are formatted separately, so that
+    the template only needs to be parsed once.
+    """
+    return tuple(shlex.split(command))
+
+
+def is_batch_command(command):
+    # type: (str) -> bool
+    """Return whether the command is run once per file."""
+    return '{linenos}' in command
+
+
+@cache
+def check_command(command):
+    # type: (str) -> None
+    """Check the placeholders of a command template.
+
+    Raises
+    ------
+    ValueError
+        if the template is malformed, or uses a placeholder that is not
+        available to it.
+    """
+    if is_batch_command(command):
+        allowed = BATCH_COMMAND_FIELDS
+    else:
+        allowed = COMMAND_FIELDS
+    for arg in split_command(command):
+        try:
+            fields = [field for _, field, _, _ in string.Formatter().parse(arg)
+                      if field is not None]
+        except ValueError as err:
+            raise ValueError("Invalid command %r: %s" % (command, err))
+        for field in fields:
+            # strip any attribute or index, as in {filename.upper}
+            name = re.split(r'[.\[]', field, 1)[0]
+            if name not in allowed:
+                raise ValueError(
+                    "Invalid command %r: unknown placeholder {%s} "
+                    "(expected one of: %s)" %
+                    (command, field,
+                     ', '.join('{%s}' % x for x in sorted(allowed))))
+
+
 class FixAnnotateCommand(BaseFixAnnotateFromSignature):
     """Inserts annotations based on a command run in a subprocess for each
     location.  The command is expected to output a json string in the same
     format output by `dmypy suggest` and `pyannotate_tool --type-info`
+
+    If the command contains a `{linenos}` placeholder, it is instead run once
+    per file, with a comma-separated list of the line numbers of every
+    function in the file, and its output should contain an entry for each of
+    those functions, identified by its "line".
     """
 
+    def start_tree(self, tree, filename):
+        super(FixAnnotateCommand, self).start_tree(tree, filename)
+        # signatures from a batch command, keyed by line number
+        self._batch_signatures = None  # type: Optional[Dict[int, Dict[str, Any]]]
+        if is_batch_command(self.type_options['command']):
+            self._batch_signatures = self.get_batch_signatures(tree)
+
     def get_command(self, funcname, filename, lineno):
         # type: (str, str, int) -> List[str]
-        command = self.type_options['command']
-        return shlex.split(command.format(filename=filename, lineno=lineno,
-                                          funcname=funcname))
+        return [arg.format(filename=filename, lineno=lineno, funcname=funcname)
+                for arg in split_command(self.type_options['command'])]
 
-    def get_types(self, node, results, funcname):
-        # type: (Node, Dict[str, Any], str) -> Optional[Tuple[List[str], str]]
-        cmd = self.get_command(funcname, self.filename, node.get_lineno())
+    def get_batch_command(self, filename, linenos):
+        # type: (str, List[int]) -> List[str]
+        linenos_str = ','.join(str(x) for x in linenos)
+        return [arg.format(filename=filename, linenos=linenos_str)
+                for arg in split_command(self.type_options['command'])]
+
+    def run_command(self, cmd, lineno):
+        # type: (List[str], int) -> Optional[bytes]
+        """Run `cmd` and return its output, or None if it failed."""
         try:
-            out = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+            return subprocess.check_output(cmd, stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError as err:
             # dmypy suggest exits 2 anytime it can't generate a suggestion,
             # even for somewhat expected cases like when --no-any is enabled:
             if err.returncode != 2:
                 self.log_message("Line %d: Failed calling %r: %s" %
-                                 (node.get_lineno(), cmd,
+                                 (lineno, cmd,
                                   err.output.rstrip().encode()))
-            return None
         except OSError as err:
             self.log_message("Line %d: Failed calling %r: %s" %
-                             (node.get_lineno(), cmd, err))
-            return None
+                             (lineno, cmd, err))
+        return None
+
+    def get_batch_signatures(self, tree):
+        # type: (Node) -> Dict[int, Dict[str, Any]]
+        """Run the command once for all of the functions in `tree`.
+
+        Entries of the output that are not valid are logged and skipped.
+        """
+        linenos = [node.get_lineno() for node in tree.pre_order()
+                   if node.type == syms.funcdef]
+        if not linenos:
+            return {}
+        cmd = self.get_batch_command(self.filename, linenos)
+        out = self.run_command(cmd, linenos[0])
+        if out is None:
+            return {}
+        try:
+            data = json.loads(out)
+        except ValueError as err:
+            self.log_message("Line %d: Invalid json from %r: %s" %
+                             (linenos[0], cmd, err))
+            return {}
+        if not isinstance(data, list):
+            self.log_message("Line %d: Expected a json list from %r" %
+                             (linenos[0], cmd))
+            return {}
+        signatures = {}  # type: Dict[int, Dict[str, Any]]
+        for it in data:
+            try:
+                line, signature = it['line'], it['signature']
+                if 'arg_types' not in signature or 'return_type' not in signature:
+                    raise KeyError('signature')
+            except (KeyError, TypeError):
+                self.log_message("Line %d: Skipping invalid entry from %r: %r" %
+                                 (linenos[0], cmd, it))
+                continue
+            signatures[line] = signature
+        return signatures
 
-        data = json.loads(out)
-        signature = data[0]['signature']
+    def get_types(self, node, results, funcname):
+        # type: (Node, Dict[str, Any], str) -> Optional[Tuple[List[str], str]]
+        if self._batch_signatures is not None:
+            signature = self._batch_signatures.get(node.get_lineno())
+            if signature is None:
+                return None
+        else:
+            cmd = self.get_command(funcname, self.filename, node.get_lineno())
+            out = self.run_command(cmd, node.get_lineno())
+            if out is None:
+                return None
+            data = json.loads(out)
+            signature = data[0]['signature']
         return [cleanup(arg, node) for arg in signature['arg_types']], \
             cleanup(signature['return_type'], node)
@@ -1,5 +1,6 @@
 from __future__ import absolute_import, print_function
 
+import ast
 from lib2to3 import pytree
 from lib2to3.fixer_util import does_tree_import, syms
 from lib2to3.pgen2 import token
@@ -7,7 +8,7 @@ from lib2to3.pytree import Node
 from typing import Any, Dict, List, Match, Optional, Tuple, cast
 
 from ..docs import formats
-from .base import get_funcname, typing_all
+from .base import typing_all
 from .fix_annotate_json import BaseFixAnnotateFromSignature
 
 SPECIAL_METHOD_RETURN = {
@@ -45,6 +46,32 @@ def find_classdef(node):
         node = parent
 
 
+def string_literal_value(literal):
+    # type: (str) -> str
+    """
+    Return the value of a python string literal, such as a docstring.
+
+    Parameters
+    ----------
+    literal : str
+        the source of the literal, including its quotes
+
+    Returns
+    -------
+    str
+    """
+    if '\\' not in literal:
+        # the common case of a plain docstring, without a prefix or escape
+        # sequences, whose value is simply what is between the quotes
+        for quote in ('"""', "'''", '"', "'"):
+            if literal.startswith(quote):
+                if (len(literal) >= 2 * len(quote) and
+                        literal.endswith(quote)):
+                    return literal[len(quote):-len(quote)]
+                break
+    return ast.literal_eval(literal)
+
+
 def get_docstring(suite):
     # type: (list) -> Tuple[Optional[str], int]
     """
@@ -72,10 +99,8 @@ def get_docstring(suite):
         leaf = doc_node.children[0]
         if not isinstance(leaf, pytree.Leaf):
             raise RuntimeError
-        doc = leaf.value
         # convert '"docstring"' to 'docstring'
-        # FIXME: something better than eval
-        return eval(doc), leaf.lineno
+        return string_literal_value(leaf.value), leaf.lineno
     else:
         # no docstring
         return None, -1
@@ -106,9 +131,45 @@ def keep_arg(i, arg_name, typ):
     return not (i == 0 and arg_name in {'self', 'cls'} and typ is None)
 
 
+def get_arg_type(i, arg_name, kind, argtype_map, default_arg_types, is_method):
+    # type: (int, str, str, Dict[str, str], Optional[Dict[str, str]], bool) -> Optional[str]
+    """
+    Return the annotation of an argument, or None if it should be omitted.
+
+    Parameters
+    ----------
+    i : int
+        position within the arg list
+    arg_name : str
+    kind : str
+        '*' or '**' for variable arguments, otherwise ''
+    argtype_map : Dict[str, str]
+        types parsed from the docstring
+    default_arg_types : Optional[Dict[str, str]]
+        types to use for arguments missing from the docstring
+    is_method : bool
+
+    Returns
+    -------
+    Optional[str]
+    """
+    typ = argtype_map.get(arg_name)
+    if typ is None and default_arg_types is not None:
+        typ = default_arg_types.get(arg_name)
+    if is_method and not keep_arg(i, arg_name, typ):
+        return None
+    return kind + _get_type(typ).strip('*')
+
+
 class FixAnnotateDocs(BaseFixAnnotateFromSignature):
     """Inserts annotations by parsing docstrings."""
 
+    def start_tree(self, tree, filename):
+        super(FixAnnotateDocs, self).start_tree(tree, filename)
+        self._doc_format = self.type_options['doc_format']
+        self._doc_default_return_type = \
+            self.type_options['doc_default_return_type']
+
     def get_format(self):
         # type: () -> str
         """
@@ -116,7 +177,7 @@ class FixAnnotateDocs(BaseFixAnnotateFromSignature):
         -------
         str
         """
-        return self.type_options['doc_format']
+        return self._doc_format
 
     def get_default_return_type(self):
         # type: () -> str
@@ -125,7 +186,7 @@ class FixAnnotateDocs(BaseFixAnnotateFromSignature):
         -------
         str
         """
-        return self.type_options['doc_default_return_type']
+        return self._doc_default_return_type
 
     def parse_docstring(self, docstring, line):
         # type: (str, int) -> Tuple[Dict[str, str], Optional[str]]
@@ -170,11 +231,14 @@ class FixAnnotateDocs(BaseFixAnnotateFromSignature):
 
         docstring, line = get_docstring(suite)
 
-        args = results.get("args")
         name_node = results["name"]
+        short_funcname = name_node.value
+        if docstring is None and short_funcname != '__init__':
+            # only __init__ can fall back to a docstring elsewhere, so avoid
+            # looking for the class of every undocumented function
+            return None
 
-        funcname = get_funcname(node)
-        short_funcname = funcname.rsplit('.')[-1]
+        args = results.get("args")
 
         class_suite = find_classdef(name_node)
         is_method = class_suite is not None
@@ -200,18 +264,22 @@ class FixAnnotateDocs(BaseFixAnnotateFromSignature):
 
         ret_type = _get_type(ret_type, default_return)
 
+        default_arg_types = formats.default_arg_types or None
+
         if args:
             # if args.type == syms.tfpdef:
             #     pass
             if args.type == syms.typedargslist:
-                arg_list = []  # type: List[str]
-                kind_list = []  # type: List[str]
+                i = 0
                 consume = True
                 kind = ''
                 for arg in args.children:
                     if consume and arg.type == token.NAME:
-                        arg_list.append(arg.value)
-                        kind_list.append(kind)
+                        arg_type = get_arg_type(i, arg.value, kind, argtype_map,
+                                                default_arg_types, is_method)
+                        if arg_type is not None:
+                            arg_types.append(arg_type)
+                        i += 1
                         consume = False
                     elif consume and arg.type == token.STAR:
                         kind = '*'
@@ -221,18 +289,13 @@ class FixAnnotateDocs(BaseFixAnnotateFromSignature):
                         consume = True
                         kind = ''
             elif args.type == token.NAME:
-                arg_list = [args.value]
-                kind_list = ['']
+                arg_type = get_arg_type(0, args.value, '', argtype_map,
+                                        default_arg_types, is_method)
+                if arg_type is not None:
+                    arg_types.append(arg_type)
             else:
                 raise TypeError(args)
 
-            for i, (arg_name, kind) in enumerate(zip(arg_list, kind_list)):
-                typ = argtype_map.get(arg_name)
-                if typ is None and formats.default_arg_types:
-                    typ = formats.default_arg_types.get(arg_name)
-                if not is_method or keep_arg(i, arg_name, typ):
-                    arg_types.append(kind + _get_type(typ).strip('*'))
-
         arg_types = [self.update_type_names(arg_type, node) for arg_type in arg_types]
         ret_type = self.update_type_names(ret_type, node)
         return arg_types, ret_type
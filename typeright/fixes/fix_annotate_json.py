@@ -29,42 +29,76 @@ except ImportError:
     # In Python 3.5.1 stdlib, typing.py does not define Text
     Text = str  # type: ignore
 
-from .base import BaseFixAnnotateFromSignature
+from .base import BaseFixAnnotateFromSignature, intern_str
 
 
 class FixAnnotateJson(BaseFixAnnotateFromSignature):
 
+    def __init__(self, options, log):
+        super(FixAnnotateJson, self).__init__(options, log)
+        self._indexed_type_info = None  # type: Optional[List[Any]]
+        self._type_info_index = {}  # type: Dict[Tuple[str, str], List[int]]
+
+    def start_tree(self, tree, filename):
+        super(FixAnnotateJson, self).start_tree(tree, filename)
+        self._type_info = self.type_options.get('type_info', [])  # type: List[Any]
+        self._top_dir = self.type_options.get('top_dir', '')  # type: str
+
+    def get_type_info_index(self):
+        # type: () -> Dict[Tuple[str, str], List[int]]
+        """Return a mapping of (path, func_name) to positions within the type info.
+
+        Paths are absolute and normalized.  Each item is indexed both by its
+        path as it appears in the json, and by that path joined to `top_dir`.
+        The index is built the first time it is needed, so that looking up a
+        function does not require a scan of the entire type info.
+
+        Returns
+        -------
+        Dict[Tuple[str, str], List[int]]
+        """
+        data = self._type_info
+        if data is not self._indexed_type_info:
+            top_dir = self._top_dir
+            index = {}  # type: Dict[Tuple[str, str], List[int]]
+            for i, it in enumerate(data):
+                # many items share a path, and interned keys compare by
+                # identity with the interned path of the current file
+                func_name = intern_str(it['func_name'])
+                path = intern_str(os.path.abspath(it['path']))
+                index.setdefault((path, func_name), []).append(i)
+                full_path = intern_str(
+                    os.path.abspath(os.path.join(top_dir, it['path'])))
+                if full_path != path:
+                    index.setdefault((full_path, func_name), []).append(i)
+            self._type_info_index = index
+            self._indexed_type_info = data
+        return self._type_info_index
+
     def get_types(self, node, results, funcname):
         # type: (Union[Leaf, Node], Dict[str, Any], str) -> Optional[Tuple[List[str], str]]
-        data = self.type_options['type_info']
-        top_dir = self.type_options['top_dir']
-        # FIXME: this lookup code is inefficient and fragile.  We should restructure
-        #  the json to be keyed by (funcname, rel path), and compute a rel path from self.filename.
+        data = self._type_info
+        index = self.get_type_info_index()
         # We are using relative paths in the JSON.
-        items = [
-            it for it in data
-            if it['func_name'] == funcname and
-            (it['path'] == self.filename or
-                os.path.join(top_dir, it['path']) == os.path.abspath(self.filename))
-        ]
-        if len(items) > 1:
-            # this can happen, because of
+        positions = index.get((self._abs_filename, funcname), [])
+        items = [data[i] for i in positions]
+        if items:
+            lineno = node.get_lineno()
+            # there can be more than one match, because of
             # 1) nested functions
             # 2) method decorators
-            # as a cheap and dirty solution we just return the nearest one by the line number
+            # as a cheap and dirty solution we just use the nearest one by the line number
             # (keep the commented-out log_message call in case we need to come back to this)
             # self.log_message("%s:%d: duplicate signatures for %s (at lines %s)" %
-            # (items[0]['path'], node.get_lineno(), items[0]['func_name'],
+            # (items[0]['path'], lineno, items[0]['func_name'],
             # ", ".join(str(it['line']) for it in items)))
-            items.sort(key=lambda it: abs(node.get_lineno() - it['line']))
-        if items:
-            it = items[0]
+            it = min(items, key=lambda it: abs(lineno - it['line']))
             # If the line number is too far off, the source probably drifted
             # since the trace was collected; it's better to skip this node.
             # (Allow some drift, since decorators also cause an offset.)
-            if abs(node.get_lineno() - it['line']) >= self.line_drift:
+            if abs(lineno - it['line']) >= self.line_drift:
                 self.log_message("%s:%d: '%s' signature from line %d too far away -- skipping" %
-                                 (self.filename, node.get_lineno(), it['func_name'], it['line']))
+                                 (self.filename, lineno, it['func_name'], it['line']))
                 return None
             if 'signature' in it:
                 return it['signature']['arg_types'], it['signature']['return_type']
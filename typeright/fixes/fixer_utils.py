@@ -9,95 +9,40 @@ from lib2to3.pytree import Base
 from typing import (TYPE_CHECKING, Any, Callable, Dict, Generator, NamedTuple,
                     Optional, Set, Tuple, Union)
 
-from kids.cache import cache
-
 # ------------- caching helpers --------------- #
 
 
-class HashableNode(object):
-    """
-    Hashable wrapper for node and leaf objects in order to cache
+def node_cache(func):
     """
+    Caches the result of a function of a single CST node.
 
-    def __init__(self, node):
-        # type: (Union[Node, Leaf]) -> None
-        """
-        Parameters
-        -----------
-        node : Union[Node, Leaf]
-        """
-        self.node = node
-
-    def __hash__(self):
-        return hash((self.node.get_lineno(),
-                     self.node.depth(),
-                     self.node.__str__()))
-
-
-def wrap_cachable(func):
-    """
-    Converts the CST node objects of a function into HashableNodes to allow the decorated
-    function to be cached (provided that all other arguments are hashable).
+    Nodes are neither hashable nor immutable, so the result is stored on the node itself: it lives
+    exactly as long as the node does, and it is only valid while the node is unchanged.  Only use
+    this for nodes that are not edited once parsed, such as import statements.
     """
-    def inner(*args, **kwargs):
-        args, kwargs = _transform_by_type(HashableNode, Base,
-                                          *args, **kwargs)
+    attr = '_cached_' + func.__name__
 
-        return func(*args, **kwargs)
+    def inner(node):
+        try:
+            return node.__dict__[attr]
+        except KeyError:
+            result = node.__dict__[attr] = func(node)
+            return result
     return inner
 
 
-def unwrap_cachable(func):
-    """
-    Converts any HashableNodes in the argument list of a function into their standard node
-    counterparts.
-    """
-    def inner(*args, **kwargs):
-        args, kwargs = _transform_by_type(lambda hashable: hashable.node, HashableNode,
-                                          *args, **kwargs)
-
-        return func(*args, **kwargs)
-    return inner
-
-
-def node_cache(func):
-    """
-    Catch-all decorator to handle caching nodes of the CST
-    """
-    return wrap_cachable(cache(unwrap_cachable(func)))
-
-
-# ------------------ other decorators ------------------ #
-
-
-def force_root_args(func):
-    """
-    Given any function with a node argument, this decorator converts the node into its root parent.
-    If a function has this decorator, all nodes with the same root will be treated the same.
-
-    In our codebase, we often have a singular node available, but want to access the root of that
-    node in some function. If we want to cache such a function, we must convert the node into root
-    before we cache rather than within the function. This is the motivation behind this decorator.
-    """
-    def inner(*args, **kwargs):
-        args, kwargs = _transform_by_type(find_root, Base,
-                                          *args, **kwargs)
-
-        return func(*args, **kwargs)
-    return inner
+# ------------------- utils ---------------------- #
 
 
-def _transform_by_type(transformer, type, *args, **kwargs):
+def node_value(node):
+    # type: (Base) -> str
     """
-    Convenience function for our decorators
+    Returns the source of a node without any whitespace or comments, e.g. the dotted name
+    `a.b.c`. Unlike str(node), this does not build the prefix of each of its leaves.
     """
-    new_args = (transformer(arg) if isinstance(arg, type) else arg for arg in args)
-    new_kwargs = {k: transformer(v) if isinstance(v, type) else v for k, v in kwargs}
-
-    return new_args, new_kwargs
-
-
-# ------------------- utils ---------------------- #
+    if isinstance(node, Leaf):
+        return node.value
+    return ''.join(leaf.value for leaf in node.leaves())
 
 
 def type_by_import_stmt(package, name, node):
@@ -149,29 +94,27 @@ def is_import_stmt(node):
             is_import(node.children[0]))
 
 
-def _generate_import_node(package, name, prefix=""):
-
-    def DottedName(name, prefix=""):
-        split = name.rsplit('.')
-        if len(split) > 1:
-            # Reconstruct the dotted name as a list of leaves
-            leftmost_name = Leaf(token.NAME, split[0])
-            children = [leftmost_name]
-            for entry in split[1:]:
-                next_name = [Leaf(token.DOT, '.'), Leaf(token.NAME, entry)]
-                children.extend(next_name)
-            return Node(syms.dotted_name, children, prefix=prefix)
+def _dotted_name(name, prefix=""):
+    if '.' not in name:
         return Leaf(token.NAME, name, prefix=prefix)
+    # Reconstruct the dotted name as a list of leaves
+    split = name.split('.')
+    children = [Leaf(token.NAME, split[0])]
+    for entry in split[1:]:
+        children.extend([Leaf(token.DOT, '.'), Leaf(token.NAME, entry)])
+    return Node(syms.dotted_name, children, prefix=prefix)
+
 
+def _generate_import_node(package, name, prefix=""):
     if not package:
         import_ = Node(syms.import_name, [
             Leaf(token.NAME, "import", prefix=prefix),
-            DottedName(name, prefix=" ")
+            _dotted_name(name, prefix=" ")
         ])
     else:
         import_ = Node(syms.import_from, [
             Leaf(token.NAME, "from", prefix=prefix),
-            DottedName(package, prefix=" "),
+            _dotted_name(package, prefix=" "),
             Leaf(token.NAME, "import", prefix=" "),
             Leaf(token.NAME, name, prefix=" "),
         ])
@@ -195,26 +138,23 @@ def _get_bottom_of_imports(root):
     """
     # figure out where to insert the new import.  First try to find
     # the first import and then skip to the last one.
-    insert_pos = offset = 0
+    last_import = -1
     for idx, node in enumerate(root.children):
-        if not is_import_stmt(node):
-            continue
-        for offset, node2 in enumerate(root.children[idx:]):
-            if not is_import_stmt(node2):
-                break
-        insert_pos = idx + offset
-        break
+        if is_import_stmt(node):
+            last_import = idx
+        elif last_import >= 0:
+            break
+    if last_import >= 0:
+        return last_import + 1
 
     # if there are no imports where we can insert, find the docstring.
     # if that also fails, we stick to the beginning of the file
-    if insert_pos == 0:
-        for idx, node in enumerate(root.children):
-            if (node.type == syms.simple_stmt and node.children and
-                    node.children[0].type == token.STRING):
-                insert_pos = idx + 1
-                break
+    for idx, node in enumerate(root.children):
+        if (node.type == syms.simple_stmt and node.children and
+                node.children[0].type == token.STRING):
+            return idx + 1
 
-    return insert_pos
+    return 0
 
 
 def create_import(package, name, node):
@@ -238,6 +178,7 @@ def create_import(package, name, node):
 
     children = [import_, Newline()]
     root.insert_child(insert_pos, Node(syms.simple_stmt, children))
+    clear_import_index(root)
 
 
 # -------------- TYPE_CHECKING LOGIC ------------------ #
@@ -274,6 +215,7 @@ def _new_type_check_with_import(package, name, root, insert_pos):
     # Make sure to import TYPE_CHECKING just before using
     import_type_checking = [_generate_import_node('typing', 'TYPE_CHECKING'), Newline()]
     root.insert_child(insert_pos, Node(syms.simple_stmt, import_type_checking))
+    clear_import_index(root)
 
 
 def create_type_checking_import(package, name, node):
@@ -295,7 +237,7 @@ def create_type_checking_import(package, name, node):
         # if_stmt: 'if' namedexpr_test ':' suite ('elif' namedexpr_test ':' suite)* ['else' ':' suite]
         if not node.type == syms.if_stmt:
             return False
-        stmt = str(node.children[1]).strip()
+        stmt = node_value(node.children[1])
         if stmt in ('typing.TYPE_CHECKING', 'TYPE_CHECKING'):
             return True
 
@@ -328,20 +270,21 @@ def create_type_checking_import(package, name, node):
     parent.insert_child(insert_pos, Node(syms.simple_stmt, children))
 
 
-@force_root_args
-@node_cache
-def get_unprotected_imports(root):
+def get_unprotected_imports(node):
+    # type: (Node) -> Set[str]
     """
-    Returns all imports of a syntax tree at the global level. So any imports inside a TYPE_CHECKING
-    block or defined inside of a method or class are not included. Intended to be used once, before
-    any editing of the tree, so we can cache for efficiency.
+    Returns all imports of the syntax tree of a node at the global level. So any imports inside a
+    TYPE_CHECKING block or defined inside of a method or class are not included. Both the packages
+    imported from and the full names imported are included, e.g. `import a.b` and `from a import b`
+    each give {'a', 'a.b'}.
     """
-    imports = set([])  # type: Set[str]
-    for child in root.children:
-        if is_import_stmt(child):
-            ret = get_import_info(child.children[0])
-            imports = set(ret.imports.keys())
-
+    imports = set()  # type: Set[str]
+    for package, bindings in get_import_index(find_root(node)).items():
+        if package:
+            imports.add(package)
+            imports.update(package + '.' + entry for entry in bindings)
+        else:
+            imports.update(bindings)
     return imports
 
 
@@ -387,7 +330,7 @@ def touch_import(package, name, node):
     return name
 
 
-_block_syms = {syms.funcdef, syms.classdef, syms.trailer}
+_block_syms = frozenset([syms.funcdef, syms.classdef, syms.trailer])
 
 
 def _find(name, node):
@@ -395,19 +338,17 @@ def _find(name, node):
     while nodes:
         node = nodes.pop()
         if node.type > 256 and node.type not in _block_syms:
-            nodes.extend(node.children)
-        elif node.type == token.NAME and node.value.strip() == name:
+            # reversed, so that the children are visited from left to right
+            nodes.extend(reversed(node.children))
+        elif node.type == token.NAME and node.value == name:
+            # the whitespace around a name is in its prefix, not its value
             return node
     return None
 
 
-ImportPairing = NamedTuple("ImportPairing", [
-    ("entry", str),
-    ("binding_name", str)
-])
-
+# imports maps each package to the names imported from it, and each of those to its binding name
 ImportNodeInfo = NamedTuple("ImportNodeInfo", [
-    ("imports", Dict[str, Set[ImportPairing]]),
+    ("imports", Dict[str, Dict[str, str]]),
     ("node", Node)
 ])
 
@@ -418,6 +359,55 @@ ImportInfo = NamedTuple("ImportInfo", [
 ])
 
 
+def get_import_index(root):
+    # type: (Node) -> Dict[str, Dict[str, str]]
+    """
+    Returns the imports at the global level of a syntax tree, as a mapping of each imported
+    package to a mapping of the names imported from it to the names they are bound to. When a name
+    is imported more than once, the first import wins.
+
+    The index is stored on the root until clear_import_index() is called, which must be done
+    whenever the imports of the tree are changed. create_import() and create_type_checking_import()
+    do so themselves.
+
+    Parameters
+    -----------
+    root : Node
+
+    Return
+    -----------
+    Dict[str, Dict[str, str]]
+    """
+    index = root.__dict__.get('_import_index')
+    if index is not None:
+        return index
+
+    index = {}  # type: Dict[str, Dict[str, str]]
+    for child in root.children:
+        if child.type != syms.simple_stmt:
+            continue
+        for stmt in child.children:
+            if not is_import(stmt):
+                continue
+            for package, entries in get_import_info(stmt).imports.items():
+                bindings = index.setdefault(package, {})
+                for entry, binding_name in entries.items():
+                    # a star import binds no name that we can know of
+                    if entry is not None:
+                        bindings.setdefault(entry, binding_name)
+
+    root._import_index = index
+    return index
+
+
+def clear_import_index(node):
+    # type: (Node) -> None
+    """
+    Forgets the import index of the syntax tree of a node, so that it is rebuilt on next use.
+    """
+    find_root(node).__dict__.pop('_import_index', None)
+
+
 def find_import_info(package, name, node):
     # type: (str, str, Node) -> Optional[ImportInfo]
     """
@@ -435,22 +425,10 @@ def find_import_info(package, name, node):
     -----------
     Optional[ImportInfo]
     """
-    for child in node.children:
-        if is_import(child):
-            ret = get_import_info(child)
-            imports = ret.imports.get(package)
-            if imports is None:
-                return None
-            import_ = next((x for x in imports if x.entry == name), None)
-            if import_:
-                return ImportInfo(import_.entry, package, import_.binding_name)
-        elif child.type == syms.simple_stmt:
-            res = find_import_info(package, name, child)
-            if res is None:
-                continue
-            else:
-                return res
-    return None
+    bindings = get_import_index(find_root(node)).get(package)
+    if bindings is None or name not in bindings:
+        return None
+    return ImportInfo(name, package, bindings[name])
 
 
 def decompose_name(node):
@@ -475,24 +453,44 @@ def decompose_name(node):
         # Right most node will be the name, i.e. a.b.c = ['a','.','b','.','c']
         name_node = node.children[-1]
         package_nodes = node.children[:-2]
-        name = str(name_node).strip()
-        package = ''.join(str(n).strip() for n in package_nodes)
-        full = ''.join(str(n).strip() for n in node.children)
+        name = node_value(name_node)
+        package = ''.join(node_value(n) for n in package_nodes)
+        full = ''.join(node_value(n) for n in node.children)
         return package, name, full
 
     return None, None, None
 
 
+_AS_NAME_TYPES = frozenset([syms.dotted_as_name, syms.import_as_name])
+_DOTTED_NAME_TYPES = frozenset([syms.dotted_name, token.NAME])
+
+
+def _handle_name(node):
+    """
+    Returns the (pkg, name, binding) of one of the names of an import statement
+    """
+    if node.type in _AS_NAME_TYPES:
+        # [Grammar] dotted_as_name: dotted_name ['as' NAME]
+        package = import_name = None
+        name = node.children[0]
+        binding_name = node.children[2].value
+        if name.type in _DOTTED_NAME_TYPES:
+            # [Grammar] dotted_name: NAME ('.' NAME)*
+            # We don't need the third field since we know the alias will be the binding_name
+            package, import_name, _ = decompose_name(name)
+        return package, import_name, binding_name
+    # If there was no "as", we know this is dotted_name
+    # [Grammar] dotted_name: NAME ('.' NAME)*
+    return decompose_name(node)
+
+
 @node_cache
 def get_import_info(node):
     # type: (Node) -> ImportNodeInfo
     """
     If node is a valid import_stmt, this will return a named tuple for each component of the
     statement
-        ex: from a.b import c as d, e  => (imports={'a.b': [(import_name='c',
-                                                             binding_name='d'),
-                                                            (import_name='e',
-                                                             binding_name='e')]},
+        ex: from a.b import c as d, e  => (imports={'a.b': {'c': 'd', 'e': 'e'}},
                                            node=node)
 
     Since we will regularly iterate over the list import node for their information when
@@ -507,51 +505,37 @@ def get_import_info(node):
     -----------
     ImportNodeInfo
     """
-    def handle_name(node):
-        if node.type in (syms.dotted_as_name, syms.import_as_name):
-            # [Grammar] dotted_as_name: dotted_name ['as' NAME]
-            package = import_name = binding_name = None
-            name = node.children[0]
-            binding_name = str(node.children[2]).strip()
-            if name.type in (syms.dotted_name, token.NAME):
-                # [Grammar] dotted_name: NAME ('.' NAME)*
-                # We don't need the third field since we know the alias will be the binding_name
-                package, import_name, _ = decompose_name(name)
-            return package, import_name, binding_name
-        # If there was no "as", we know this is dotted_name
-        # [Grammar] dotted_name: NAME ('.' NAME)*
-        return decompose_name(node)
-
     package = None
-    imports = dict()  # type: Dict[str, Set[ImportPairing]]
+    imports = dict()  # type: Dict[str, Dict[str, str]]
     if node.type == syms.import_name:
         # [Grammar]: import_name: 'import' dotted_as_names
         as_name = node.children[1]
         if as_name.type in (syms.dotted_as_names, syms.import_as_names):
             # [Grammar]: dotted_as_names: dotted_as_name (',' dotted_as_name)*
-            as_names = [child for child in as_name.children if str(child).strip() != ',']
+            as_names = [child for child in as_name.children if child.type != token.COMMA]
         else:
             as_names = [as_name]
         for child in as_names:
-            package, import_name, binding_name = handle_name(child)
-            imports.setdefault(package, set()).add(ImportPairing(import_name, binding_name))
+            package, import_name, binding_name = _handle_name(child)
+            imports.setdefault(package, {}).setdefault(import_name, binding_name)
     elif node.type == syms.import_from:
         # [Grammar]:
         # import_from: ('from' ('.'* dotted_name | '.'+)
         #   'import' ('*' | '(' import_as_names ')' | import_as_names))
-        package = str(node.children[1]).strip()
-        if str(node.children[3]).strip() == '(':
+        package = node_value(node.children[1])
+        if node.children[3].type == token.LPAR:
             # This means we are dealing with an import statement containing parentheses
             # ex: from a import (b, c, d)
             import_as_name = node.children[4]
         else:
             import_as_name = node.children[3]
         if import_as_name.type == syms.import_as_names:
-            as_names = [child for child in import_as_name.children if str(child).strip() != ',']
+            as_names = [child for child in import_as_name.children
+                        if child.type != token.COMMA]
         else:
             as_names = [import_as_name]
         for child in as_names:
-            _, import_name, binding_name = handle_name(child)
-            imports.setdefault(package, set()).add(ImportPairing(import_name, binding_name))
+            _, import_name, binding_name = _handle_name(child)
+            imports.setdefault(package, {}).setdefault(import_name, binding_name)
 
     return ImportNodeInfo(imports, node)
@@ -4,7 +4,10 @@
 import json
 import subprocess
 
-from typeright.fixes.fix_annotate_command import FixAnnotateCommand
+import pytest
+
+from typeright.fixes.fix_annotate_command import (FixAnnotateCommand,
+                                                  check_command)
 from typeright.fixes.tests import base_py3
 
 try:
@@ -48,3 +51,113 @@ class TestFixAnnotateCommand(base_py3.AnnotateFromSignatureTestCase):
 
         self.patcher = patch('subprocess.check_output', new=check_output)
         self.patcher.start()
+
+    def test_batch_command(self):
+        self.refactor.options['typeright']['command'] = "fake {filename} {linenos}"
+        self.filename = "<string>"
+        calls = []
+
+        def check_output(cmd, **kwargs):
+            calls.append(cmd)
+            return json.dumps(
+                [{"func_name": "nop",
+                  "path": "<string>",
+                  "line": 1,
+                  "signature": {
+                      "arg_types": ["int"],
+                      "return_type": "int"},
+                  }])
+
+        self.patcher = patch('subprocess.check_output', new=check_output)
+        self.patcher.start()
+        a = """\
+            def nop(a):
+                return a
+            def other(b):
+                return b
+            """
+        b = """\
+            def nop(a: int) -> int:
+                return a
+            def other(b):
+                return b
+            """
+        self.check(a, b)
+        assert calls == [["fake", "<string>", "1,3"]]
+
+    def test_batch_command_invalid_output(self):
+        self.refactor.options['typeright']['command'] = "fake {filename} {linenos}"
+        self.filename = "<string>"
+
+        def check_output(cmd, **kwargs):
+            return json.dumps(
+                [{"func_name": "nop",
+                  "path": "<string>",
+                  "line": 1},
+                 {"func_name": "other",
+                  "path": "<string>",
+                  "line": 3,
+                  "signature": {
+                      "arg_types": ["int"],
+                      "return_type": "int"},
+                  }])
+
+        self.patcher = patch('subprocess.check_output', new=check_output)
+        self.patcher.start()
+        a = """\
+            def nop(a):
+                return a
+            def other(b):
+                return b
+            """
+        b = """\
+            def nop(a):
+                return a
+            def other(b: int) -> int:
+                return b
+            """
+        self.warns(a, b, "Skipping invalid entry")
+
+    def test_batch_command_invalid_json(self):
+        self.refactor.options['typeright']['command'] = "fake {filename} {linenos}"
+        self.filename = "<string>"
+
+        def check_output(cmd, **kwargs):
+            return b'not json'
+
+        self.patcher = patch('subprocess.check_output', new=check_output)
+        self.patcher.start()
+        a = """\
+            def nop(a):
+                return a
+            """
+        self.warns_unchanged(a, "Invalid json")
+
+    def test_check_command(self):
+        check_command("fake {funcname} {filename}:{lineno}")
+        check_command("fake {filename} {linenos}")
+        for command in ["fake {filename} {linenos} {lineno}",
+                        "fake {filename} {linenos} {funcname}",
+                        "fake {filename} {other}",
+                        "fake {filename",
+                        "fake {}"]:
+            with pytest.raises(ValueError):
+                check_command(command)
+
+    def test_filename_with_spaces(self):
+        self.filename = "my file.py"
+        calls = []
+
+        def check_output(cmd, **kwargs):
+            calls.append(cmd)
+            raise subprocess.CalledProcessError(
+                2, cmd, output='No guesses that match criteria!')
+
+        self.patcher = patch('subprocess.check_output', new=check_output)
+        self.patcher.start()
+        a = """\
+            def nop(a):
+                return a
+            """
+        self.unchanged(a)
+        assert calls == [["fake", "nop", "my file.py"]]
@@ -59,3 +59,44 @@ class TestFixAnnotateJson(base_py3.AnnotateFromSignatureTestCase):
         # trigger the fixer to run, with no expected changes
         self.unchanged("")
         mocked_set_filename.assert_called_with("/path/to/fileB.py")
+
+    def test_top_dir(self):
+        self.refactor.options['typeright']['top_dir'] = '/path/to'
+        self.setTestData(
+            [{"func_name": "nop",
+              "path": "fileA.py",
+              "line": 1,
+              "signature": {
+                  "arg_types": ["int"],
+                  "return_type": "int"},
+              }])
+        self.filename = "/path/to/fileA.py"
+        a = """\
+            def nop(a):
+                return a
+            """
+        b = """\
+            def nop(a: int) -> int:
+                return a
+            """
+        self.check(a, b)
+
+    def test_unnormalized_path(self):
+        self.setTestData(
+            [{"func_name": "nop",
+              "path": "./sub/../fileA.py",
+              "line": 1,
+              "signature": {
+                  "arg_types": ["int"],
+                  "return_type": "int"},
+              }])
+        self.filename = "fileA.py"
+        a = """\
+            def nop(a):
+                return a
+            """
+        b = """\
+            def nop(a: int) -> int:
+                return a
+            """
+        self.check(a, b)
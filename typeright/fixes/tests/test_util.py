@@ -9,6 +9,7 @@ from lib2to3.tests.test_util import parse
 from typing import NamedTuple
 
 from .. import fixer_utils
+from ..base import get_funcname
 
 
 def _to_binding(node, type):
@@ -65,10 +66,22 @@ class Test_get_import_info(TestCase):
             self.assertTrue(n.imports)
             for key in imports.keys():
                 self.assertTrue(n.imports.get(key))
-                ref = set(imports.get(key))
+                ref = dict(imports.get(key))
                 res = n.imports.get(key)
                 self.assertTrue(ref == res)
 
+    def test_cached(self):
+        node = parse("from a import b")
+        import_from = _to_binding(node, syms.import_from)
+        info = fixer_utils.get_import_info(import_from)
+        self.assertTrue(fixer_utils.get_import_info(import_from) is info)
+
+    def test_keyword(self):
+        node = parse("from a import b")
+        import_from = _to_binding(node, syms.import_from)
+        info = fixer_utils.get_import_info(node=import_from)
+        self.assertEqual(info.imports, {'a': {'b': 'b'}})
+
 
 class Test_find_import_info(TestCase):
     def find_import_info(self, package, name, string):
@@ -127,6 +140,43 @@ class Test_find_import_info(TestCase):
         self.assertTrue(res.entry == name)
         self.assertTrue(res.binding == binding)
 
+    def test_created_import(self):
+        node = parse("import a\n\nx = 1\n")
+        self.assertTrue(fixer_utils.find_import_info('b', 'c', node) is None)
+        fixer_utils.create_import('b', 'c', node)
+        res = fixer_utils.find_import_info('b', 'c', node)
+        self.assertTrue(res)
+        self.assertTrue(res.binding == 'c')
+
+    def test_replaced_import(self):
+        node = parse("from a import b\n")
+        self.assertTrue(fixer_utils.find_import_info('a', 'b', node))
+        # replace the import in place, which leaves the number of statements unchanged
+        node.children[0].replace(parse("from c import d\n").children[0].clone())
+        fixer_utils.clear_import_index(node)
+        self.assertTrue(fixer_utils.find_import_info('a', 'b', node) is None)
+        self.assertTrue(fixer_utils.find_import_info('c', 'd', node))
+
+
+class Test_get_unprotected_imports(TestCase):
+    def test(self):
+        node = parse("import a\n"
+                     "import b.c as d\n"
+                     "from e.f import g\n"
+                     "if TYPE_CHECKING:\n"
+                     "    import h\n"
+                     "def i():\n"
+                     "    import j\n")
+        self.assertEqual(fixer_utils.get_unprotected_imports(node),
+                         {'a', 'b', 'b.c', 'e.f', 'e.f.g'})
+
+    def test_star_import(self):
+        node = parse("from os.path import *\n"
+                     "import a\n")
+        self.assertEqual(fixer_utils.get_unprotected_imports(node),
+                         {'os.path', 'a'})
+        self.assertTrue(fixer_utils.find_import_info('os.path', 'join', node) is None)
+
 
 class Test_create_type_checking_import(TestCase):
     def create_type_checking_import(self, package, name, string):
@@ -178,3 +228,18 @@ class Test_create_type_checking_import(TestCase):
         res = self.create_type_checking_import("bar", "TestImport", string)
         self.assertTrue(res)
         self.assertTrue(res == ref)
+
+
+class Test_get_funcname(TestCase):
+    def test_scope_names(self):
+        node = parse("class A:\n"
+                     "    def f(self):\n"
+                     "        def g(): pass\n"
+                     "    def h(self): pass\n")
+        funcdefs = [n for n in node.pre_order() if n.type == syms.funcdef]
+        scope_names = {}
+        names = [get_funcname(n, scope_names) for n in funcdefs]
+        self.assertEqual(names, ['A.f', 'A.f.g', 'A.h'])
+        self.assertEqual(names, [get_funcname(n) for n in funcdefs])
+        self.assertEqual(sorted(name for _, name in scope_names.values()),
+                         ['A', 'A.f', 'A.f.g', 'A.h'])
@@ -0,0 +1,140 @@
+"""
+The lib2to3 refactoring tool used by the typeright command line
+"""
+
+from __future__ import absolute_import, print_function
+
+import multiprocessing
+import os
+import sys
+from lib2to3 import pygram
+from lib2to3.main import StdoutRefactoringTool
+from lib2to3.refactor import RefactoringTool, _detect_future_features
+
+from typeright import astcache
+
+
+def _fork_context():
+    """Return a multiprocessing context that forks its workers, or None.
+
+    Forked workers share the (possibly very large) type info with the parent
+    process, copy-on-write, rather than each receiving a pickled copy.  This
+    is limited to linux: on macos, fork is available but unsafe, and python 2
+    has no contexts (though it always forks on posix).
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    if not hasattr(multiprocessing, 'get_context'):
+        return None
+    return multiprocessing.get_context('fork')
+
+
+class ModifiedRefactoringTool(StdoutRefactoringTool):
+
+    def __init__(self, *args, **kwargs):
+        self.cache_dir = kwargs.pop('cache_dir', None)
+        super(ModifiedRefactoringTool, self).__init__(*args, **kwargs)
+
+    def refactor(self, items, write=False, doctests_only=False,
+                 num_processes=1):
+        """Refactor a list of files and directories.
+
+        Like the default implementation, but workers are started from a local
+        fork context where one is available, so that the start method of the
+        whole process is left unchanged.
+        """
+        context = _fork_context()
+        if num_processes == 1 or context is None:
+            return super(ModifiedRefactoringTool, self).refactor(
+                items, write, doctests_only, num_processes)
+        if self.queue is not None:
+            raise RuntimeError("already doing multiple processes")
+        self.queue = context.JoinableQueue()
+        self.output_lock = context.Lock()
+        processes = [context.Process(target=self._child)
+                     for i in range(num_processes)]
+        try:
+            for p in processes:
+                p.start()
+            # skip MultiprocessRefactoringTool.refactor(), whose workers
+            # have just been started
+            RefactoringTool.refactor(self, items, write, doctests_only)
+        finally:
+            self.queue.join()
+            for i in range(num_processes):
+                self.queue.put(None)
+            for p in processes:
+                if p.is_alive():
+                    p.join()
+            self.queue = None
+
+    def refactor_string(self, data, name):
+        """Refactor a given input string.
+
+        If a cache directory was given, the parsed tree is read from, or
+        stored in, the cache, so that unchanged files are not parsed again
+        on the next run.
+        """
+        if not self.cache_dir:
+            return super(ModifiedRefactoringTool, self).refactor_string(
+                data, name)
+
+        features = _detect_future_features(data)
+        if 'print_function' in features or self.options.get('print_function'):
+            grammar_name = 'no_print_statement'
+        elif self.options.get('exec_function'):
+            grammar_name = 'no_exec_statement'
+        else:
+            grammar_name = 'default'
+        key = astcache.get_key(data, grammar_name)
+        tree = astcache.load(self.cache_dir, key)
+        if tree is None:
+            if 'print_function' in features:
+                self.driver.grammar = pygram.python_grammar_no_print_statement
+            try:
+                tree = self.driver.parse_string(data)
+            except Exception as err:
+                self.log_error("Can't parse %s: %s: %s",
+                               name, err.__class__.__name__, err)
+                return None
+            finally:
+                self.driver.grammar = self.grammar
+            # store the tree before the fixers modify it
+            astcache.store(self.cache_dir, key, tree)
+        tree.future_features = features
+        self.log_debug("Refactoring %s", name)
+        self.refactor_tree(tree, name)
+        return tree
+
+    def refactor_dir(self, dir_name, write=False, doctests_only=False):
+        """Descends down a directory and refactor every Python file found.
+
+        Python files are assumed to have a .py extension.
+
+        Files and subdirectories starting with '.' are skipped.
+
+        Unlike the default implementation, which is based on os.walk(), this
+        uses the file type information cached on the entries returned by
+        os.scandir().
+        """
+        if not hasattr(os, 'scandir'):
+            return super(ModifiedRefactoringTool, self).refactor_dir(
+                dir_name, write, doctests_only)
+
+        self.log_debug("Descending into %s", dir_name)
+        try:
+            entries = sorted(os.scandir(dir_name), key=lambda entry: entry.name)
+        except OSError:
+            return
+        subdirs = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                # like os.walk(), do not follow symlinks to directories
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+            elif entry.name.endswith('.py'):
+                self.refactor_file(entry.path, write, doctests_only)
+        for subdir in subdirs:
+            self.refactor_dir(subdir, write, doctests_only)